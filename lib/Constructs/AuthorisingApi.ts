@@ -54,6 +54,9 @@ export class AuthorisingApiConstruct extends Construct {
             restApiName: 'DisposableEmailApi',
             description: 'This service provides disposable email addresses',
             endpointTypes: [ ApiGateway.EndpointType.REGIONAL ],
+            // getEmailFileLambda returns the raw email bytes to requests with 'Accept: message/rfc822',
+            // other requests get the email as text
+            binaryMediaTypes: [ 'message/rfc822' ],
             defaultCorsPreflightOptions: {
                 allowOrigins: CORS_ALLOWED_ORIGINS,
                 allowMethods: [ "GET", "POST", "OPTIONS" ],
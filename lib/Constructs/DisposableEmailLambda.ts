@@ -8,6 +8,7 @@ import { StorageConstruct } from "./Storage";
 import * as IAm from "aws-cdk-lib/aws-iam";
 import { SnsEventSource } from "aws-cdk-lib/aws-lambda-event-sources";
 import { Topic } from "aws-cdk-lib/aws-sns";
+import * as Triggers from "aws-cdk-lib/triggers";
 
 export type LambdaConstructProps = {
     domain: string;
@@ -31,6 +32,17 @@ export class DisposableEmailLambdaConstruct extends Construct {
     constructor( scope: Construct, id: string, props: LambdaConstructProps ) {
         super( scope, id );
 
+        /**
+         * commonLayer
+         * helpers shared by the lambdas, importable as the python package `common`
+         */
+        const commonLayer = new Lambda.LayerVersion( this, 'commonLayer', {
+            code: Lambda.Code.fromAsset( 'src/CommonLayer/' ),
+            compatibleRuntimes: [ Lambda.Runtime.PYTHON_3_9 ],
+            compatibleArchitectures: [ Lambda.Architecture.ARM_64 ],
+            description: 'shared helpers of the disposable email lambdas',
+        } );
+
         /**
          * incomingMailCheckLambda
          * called by SES when an email for *@EMAIL_DOMAIN_NAME is received to evaluate further processing
@@ -42,6 +54,7 @@ export class DisposableEmailLambdaConstruct extends Construct {
             handler: "IncomingMailCheckFunction.lambda_handler",
             runtime: Lambda.Runtime.PYTHON_3_9,
             architecture: Lambda.Architecture.ARM_64,
+            layers: [ commonLayer ],
             environment: {
                 'addresses_table_name': props.storageConstruct.disposableAddressesTable.tableName,
                 'reply_addresses_table_name': props.storageConstruct.disposableReplyAddressesTable.tableName,
@@ -71,6 +84,7 @@ export class DisposableEmailLambdaConstruct extends Construct {
             handler: "StoreEmailFunction.lambda_handler",
             runtime: Lambda.Runtime.PYTHON_3_9,
             architecture: Lambda.Architecture.ARM_64,
+            layers: [ commonLayer ],
             timeout: Duration.minutes( 5 ),
             environment: {
                 "valid_domains": props.domain,
@@ -101,6 +115,7 @@ export class DisposableEmailLambdaConstruct extends Construct {
             handler: "CreateEmailFunction.lambda_handler",
             runtime: Lambda.Runtime.PYTHON_3_9,
             architecture: Lambda.Architecture.ARM_64,
+            layers: [ commonLayer ],
             environment: {
                 "mailbox_ttl": props.mailboxTtl.toString(),
                 "valid_domains": props.domain,
@@ -122,6 +137,7 @@ export class DisposableEmailLambdaConstruct extends Construct {
             handler: "GetEmailsListFunction.lambda_handler",
             runtime: Lambda.Runtime.PYTHON_3_9,
             architecture: Lambda.Architecture.ARM_64,
+            layers: [ commonLayer ],
             environment: {
                 "cors_allowed_origins": props.corsAllowedOrigins.join( "," ),
                 "emails_table_name": props.storageConstruct.disposableEmailsTable.tableName,
@@ -143,6 +159,7 @@ export class DisposableEmailLambdaConstruct extends Construct {
             handler: "GetEmailFileFunction.lambda_handler",
             runtime: Lambda.Runtime.PYTHON_3_9,
             architecture: Lambda.Architecture.ARM_64,
+            layers: [ commonLayer ],
             environment: {
                 "cors_allowed_origins": props.corsAllowedOrigins.join( "," ),
                 "emails_table_name": props.storageConstruct.disposableEmailsTable.tableName,
@@ -167,6 +184,7 @@ export class DisposableEmailLambdaConstruct extends Construct {
             handler: "CleanUpFunction.lambda_handler",
             runtime: Lambda.Runtime.PYTHON_3_9,
             architecture: Lambda.Architecture.ARM_64,
+            layers: [ commonLayer ],
             timeout: Duration.minutes( 1 ),
             environment: {
                 "addresses_table_name": props.storageConstruct.disposableAddressesTable.tableName,
@@ -180,6 +198,27 @@ export class DisposableEmailLambdaConstruct extends Construct {
         props.storageConstruct.disposableEmailsTable.grantReadWriteData( this.cleanUpLambda );
         props.storageConstruct.emailStorageBucket.grantDelete( this.cleanUpLambda );
 
+        /**
+         * gcBucketBackfillLambda
+         * one-off migration that runs after the deployment, sets the gc_bucket of addresses
+         * created before the ttl-index so the cleanUpLambda finds them
+         * has access to:
+         *     DynamoDB table: AddressesTable
+         */
+        const gcBucketBackfillLambda = new Triggers.TriggerFunction( this, 'gcBucketBackfillLambda', {
+            code: Lambda.Code.fromAsset( 'src/GcBucketBackfillFunction/' ),
+            handler: "GcBucketBackfillFunction.lambda_handler",
+            runtime: Lambda.Runtime.PYTHON_3_9,
+            architecture: Lambda.Architecture.ARM_64,
+            layers: [ commonLayer ],
+            timeout: Duration.minutes( 15 ),
+            executeAfter: [ props.storageConstruct.disposableAddressesTable ],
+            environment: {
+                "addresses_table_name": props.storageConstruct.disposableAddressesTable.tableName,
+            }
+        } );
+        props.storageConstruct.disposableAddressesTable.grantReadWriteData( gcBucketBackfillLambda );
+
         /**
          * sendEmailLambda
          * Sends an email based on given parameters
@@ -192,6 +231,7 @@ export class DisposableEmailLambdaConstruct extends Construct {
             handler: "SendEmailFunction.lambda_handler",
             runtime: Lambda.Runtime.PYTHON_3_9,
             architecture: Lambda.Architecture.ARM_64,
+            layers: [ commonLayer ],
             timeout: Duration.minutes( 1 ),
             environment: {
                 "cors_allowed_origins": props.corsAllowedOrigins.join( "," ),
@@ -217,6 +257,7 @@ export class DisposableEmailLambdaConstruct extends Construct {
             handler: "ChangeAddressSettingsFunction.lambda_handler",
             runtime: Lambda.Runtime.PYTHON_3_9,
             architecture: Lambda.Architecture.ARM_64,
+            layers: [ commonLayer ],
             environment: {
                 "mailbox_ttl": props.mailboxTtl.toString(),
                 "cors_allowed_origins": props.corsAllowedOrigins.join( "," ),
@@ -22,6 +22,21 @@ export class StorageConstruct extends Construct {
             removalPolicy: RemovalPolicy.DESTROY,
         } );
 
+        // lets the clean up lambda query expired addresses instead of scanning the whole table.
+        // gc_bucket spreads the index over a few partitions ( ttl % 16 )
+        this.disposableAddressesTable.addGlobalSecondaryIndex( {
+            indexName: 'ttl-index',
+            partitionKey: {
+                name: 'gc_bucket',
+                type: DynamoDb.AttributeType.NUMBER,
+            },
+            sortKey: {
+                name: 'ttl',
+                type: DynamoDb.AttributeType.NUMBER,
+            },
+            projectionType: DynamoDb.ProjectionType.KEYS_ONLY,
+        } );
+
         this.disposableEmailsTable = new DynamoDb.Table( this, 'disposableEmailsTable', {
             partitionKey: {
                 name: 'destination',
@@ -44,6 +59,20 @@ export class StorageConstruct extends Construct {
             removalPolicy: RemovalPolicy.DESTROY,
         } );
 
+        // finds the redirects of a disposable address, optionally for a specific external address
+        this.disposableReplyAddressesTable.addGlobalSecondaryIndex( {
+            indexName: 'disposable-index',
+            partitionKey: {
+                name: 'disposableAddress',
+                type: DynamoDb.AttributeType.STRING,
+            },
+            sortKey: {
+                name: 'actualAddress',
+                type: DynamoDb.AttributeType.STRING,
+            },
+            projectionType: DynamoDb.ProjectionType.KEYS_ONLY,
+        } );
+
         this.emailStorageBucket = new S3.Bucket( this, 'emailStorageBucket', {
             removalPolicy: RemovalPolicy.DESTROY,
             blockPublicAccess: S3.BlockPublicAccess.BLOCK_ALL,
@@ -5,14 +5,18 @@ import json
 import os
 import logging
 
+from common.api_helpers import default_allowed_origin, parse_body, response_headers
+from common.boto_helpers import boto_config
+from common.ddb_helpers import gc_buckets, user_owns_address
+
 logger = logging.getLogger( )
 logger.setLevel( logging.INFO )
 
-dynamodb = boto3.resource( "dynamodb" )
+dynamodb = boto3.resource( "dynamodb", config = boto_config )
 address_table = dynamodb.Table( os.environ[ 'addresses_table_name' ] )
 
-cors_allowed_origins = os.environ[ 'cors_allowed_origins' ].split( ',' )
-default_allowed_origin = cors_allowed_origins[ 0 ]
+
+email_pattern = re.compile( '^.+@(\\[?)[a-zA-Z0-9\\-.]+\\.([a-zA-Z]{2,3}|[0-9]{1,3})(]?)$' )
 
 
 def extend_ttl( address, ttl ):
@@ -20,20 +24,23 @@ def extend_ttl( address, ttl ):
     Extend the TTL of a given address by the given amount of time
     :param address: the display address to extend
     :param ttl: the amount of time to extend the TTL by, in seconds
-    :raises ClientError: if the address does not exist
+    :return: True if the ttl was changed, False otherwise
     """
     try:
         address_table.update_item(
                 Key = {
                     'address': address
                 },
-                UpdateExpression = "set #value = :t",
+                UpdateExpression = "set #value = :t, gc_bucket = :b",
                 ExpressionAttributeNames = { "#value": "ttl" },
-                ExpressionAttributeValues = { ":t": ttl }
+                ExpressionAttributeValues = { ":t": ttl, ":b": ttl % gc_buckets }
         )
     except ClientError as e:
         logger.info( '## DynamoDB Client Exception' )
         logger.info( e.response[ 'Error' ][ 'Message' ] )
+        return False
+    else:
+        return True
 
 
 def validate_email( address ):
@@ -42,9 +49,9 @@ def validate_email( address ):
     :param address: the email address to validate
     :return: True if the email address is valid, False otherwise
     """
-    if type( address ) is not str:
+    if not isinstance( address, str ):
         return False
-    if re.match( '^.+@(\\[?)[a-zA-Z0-9\\-.]+\\.([a-zA-Z]{2,3}|[0-9]{1,3})(]?)$', address ) is not None:
+    if email_pattern.match( address ) is not None:
         return True
     return False
 
@@ -73,42 +80,6 @@ def change_redirect( disposable_address, redirect, redirect_email = "", ):
         return True
 
 
-def user_owns_address( address, username ):
-    """
-    check if a given address belongs to a given user
-    :param address: the disposable address to check
-    :param username: the username to check against
-    :return: True if the address belongs to the user, False otherwise
-    :raises ClientError: DynamoDB Client Exception
-    """
-    try:
-        response = address_table.get_item(
-                Key = {
-                    'address': address
-                }
-        )
-    except ClientError as e:
-        logger.info( '## DynamoDB Client Exception' )
-        logger.info( e.response[ 'Error' ][ 'Message' ] )
-    else:
-        if 'Item' in response:
-            item = response[ 'Item' ]
-            if item[ 'username' ] == username:
-                return True
-    return False
-
-
-def get_allowed_origins( origin ):
-    """
-    Gets the allowed origins from the environment and checks if a given origin is allowed
-    :param origin: the origin to check
-    :return: origin if allowed, else default origin
-    """
-    if origin in cors_allowed_origins:
-        return origin
-    return default_allowed_origin
-
-
 def lambda_handler( event, context ):
     logger.info( '## ENVIRONMENT VARIABLES' )
     logger.info( os.environ )
@@ -122,25 +93,20 @@ def lambda_handler( event, context ):
 
     disposable_address = event.get( 'pathParameters', { } ).get( 'destination' )
 
-    body = json.loads( event.get( 'body', { } ) )
+    body = parse_body( event.get( 'body' ) )
     action = body.get( "action" )
 
-    headers = {
-        "access-control-allow-headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-        "access-control-allow-methods": "GET,OPTIONS,POST",
-        "access-control-allow-origin":  get_allowed_origins( origin )
-    }
+    headers = response_headers( origin )
 
     result = { "statusCode": 400, "body": json.dumps( { "result": "missing parameters" } ), "headers": headers }
 
     if None in [ username, user_email, disposable_address, action ]:
         return result
 
-    if user_owns_address( disposable_address, username ):
+    if user_owns_address( address_table, disposable_address, username ):
         if action == "extend":
             new_ttl = body.get( "ttl" )
-            if new_ttl is not None:
-                extend_ttl( disposable_address, new_ttl )
+            if type( new_ttl ) is int and extend_ttl( disposable_address, new_ttl ):
                 result = { "statusCode": 200,
                            "body":       json.dumps(
                                    { "result": "success",
@@ -1,15 +1,27 @@
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.table import BatchWriter
 import os
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.boto_helpers import boto_config
+from common.ddb_helpers import gc_buckets
 
 logger = logging.getLogger( )
 logger.setLevel( logging.INFO )
 
-dynamodb = boto3.resource( "dynamodb" )
-s3 = boto3.client( 's3' )
+# expired addresses are cleaned up concurrently, the work is almost entirely waiting on the network
+cleanup_workers = 64
+
+# one connection per clean up worker
+cleanup_boto_config = boto_config.merge( Config( max_pool_connections = cleanup_workers ) )
+
+dynamodb = boto3.resource( "dynamodb", config = cleanup_boto_config )
+# most scheduled runs find nothing to delete, the S3 client is only created when it is needed
+s3 = None
 
 addresses_table = dynamodb.Table( os.environ[ 'addresses_table_name' ] )
 emails_table = dynamodb.Table( os.environ[ 'emails_table_name' ] )  # noqa
@@ -17,40 +29,87 @@ reply_addresses_table = dynamodb.Table( os.environ[ 'reply_addresses_table_name'
 
 bucket_name = os.environ[ 'emails_bucket_name' ]
 
+# Table resources are not thread safe, the clean up workers use the client of the resource instead
+dynamodb_client = dynamodb.meta.client
 
-def delete_object( bucket, object_name ):
-    """Delete an object from an S3 bucket
+
+def get_s3_client( ):
+    """
+    Returns the S3 client and creates it on first use
+    Client creation is not thread safe, call this before the clean up workers start
+
+    :return: boto3 S3 client
+    """
+    global s3
+    if s3 is None:
+        s3 = boto3.client( 's3', config = cleanup_boto_config )
+    return s3
+
+
+def query_items( table, **query_args ):
+    """
+    Queries a table or index and yields the items page by page, as the pages arrive
+    The query goes through the shared client, so the clean up workers can use it
+
+    :param table: DynamoDB table to query
+    :param query_args: arguments of the query
+    :return: generator of the items of all result pages
+    :raises ClientError: DynamoDB client error
+    """
+    while True:
+        response = dynamodb_client.query( TableName = table.name, **query_args )
+        yield from response[ 'Items' ]
+        if 'LastEvaluatedKey' not in response:
+            return
+        query_args[ 'ExclusiveStartKey' ] = response[ 'LastEvaluatedKey' ]
+
+
+def delete_objects( bucket, object_names ):
+    """Delete objects from an S3 bucket, up to 1000 per request
 
     :param bucket: string
-    :param object_name: string
-    :return: True if the referenced object was deleted, otherwise False
+    :param object_names: list of strings
+    :return: True if all referenced objects were deleted, otherwise False
     """
     logger.info( '## Deleting S3' )
-    logger.info( bucket + object_name )
-
-    # Delete the object
-    try:
-        s3.delete_object( Bucket = bucket, Key = object_name )
-    except ClientError as e:
-        logger.error( e )
-        return False
-    return True
+    logger.info( object_names )
+
+    deleted = True
+    for i in range( 0, len( object_names ), 1000 ):
+        try:
+            response = get_s3_client( ).delete_objects(
+                    Bucket = bucket,
+                    Delete = {
+                        'Objects': [ { 'Key': key } for key in object_names[ i:i + 1000 ] ],
+                        'Quiet':   True
+                    }
+            )
+        except ClientError as e:
+            logger.error( e )
+            deleted = False
+        else:
+            for error in response.get( 'Errors', [ ] ):
+                logger.error( error )
+                deleted = False
+    return deleted
 
 
-def delete_email_item( destination, message_id ):
+def delete_email_items( destination, message_ids ):
     """
-    Delete an email item from the emails table
+    Delete email items from the emails table
     :param destination: disposable address
-    :param message_id: message id to delete
+    :param message_ids: message ids to delete
     :raises ClientError: DynamoDB client error
     """
     try:
-        emails_table.delete_item(
-                Key = {
-                    'destination': destination,
-                    'messageId':   message_id
-                }
-        )
+        with BatchWriter( emails_table.name, dynamodb_client ) as writer:
+            for message_id in message_ids:
+                writer.delete_item(
+                        Key = {
+                            'destination': destination,
+                            'messageId':   message_id
+                        }
+                )
     except ClientError as e:
         logger.error( '## DynamoDB Client Exception' )
         logger.error( e.response[ 'Error' ][ 'Message' ] )
@@ -64,35 +123,39 @@ def delete_reply_address_item( disposable_address ):
     :raises ClientError: DynamoDB client error
     """
     try:
-        response = reply_addresses_table.scan(
-                FilterExpression = Attr( 'disposableAddress' ).eq( disposable_address ),
-                ProjectionExpression = "proxyAddress"
-        )
+        with BatchWriter( reply_addresses_table.name, dynamodb_client ) as writer:
+            for i in query_items(
+                    reply_addresses_table,
+                    IndexName = 'disposable-index',
+                    KeyConditionExpression = "disposableAddress = :d",
+                    ExpressionAttributeValues = { ":d": disposable_address },
+                    ProjectionExpression = "proxyAddress"
+            ):
+                writer.delete_item(
+                        Key = {
+                            'proxyAddress': i[ 'proxyAddress' ]
+                        }
+                )
     except ClientError as e:
         logger.error( '## DynamoDB Client Exception' )
         logger.error( e.response[ 'Error' ][ 'Message' ] )
-    else:
-        for i in response[ 'Items' ]:
-            reply_addresses_table.delete_item(
-                    Key = {
-                        'proxyAddress': i[ 'proxyAddress' ]
-                    }
-            )
 
 
-def delete_address_item( address ):
+def delete_address_items( addresses ):
     """
-    Deletes a disposable address from the addresses table
+    Deletes disposable addresses from the addresses table
 
-    :param address: disposable address to delete
+    :param addresses: disposable addresses to delete
     :raises ClientError: DynamoDB client error
     """
     try:
-        addresses_table.delete_item(
-                Key = {
-                    'address': address
-                }
-        )
+        with addresses_table.batch_writer( ) as writer:
+            for address in addresses:
+                writer.delete_item(
+                        Key = {
+                            'address': address
+                        }
+                )
     except ClientError as e:
         logger.error( '## DynamoDB Client Exception' )
         logger.error( e.response[ 'Error' ][ 'Message' ] )
@@ -106,39 +169,74 @@ def delete_emails( destination ):
     :raises ClientError: DynamoDB client error
     """
     try:
-        response = emails_table.query(
-                KeyConditionExpression = Key( 'destination' ).eq( destination ),
+        message_ids = [ i[ 'messageId' ] for i in query_items(
+                emails_table,
+                KeyConditionExpression = "destination = :d",
+                ExpressionAttributeValues = { ":d": destination },
                 ProjectionExpression = "messageId"
-        )
+        ) ]
     except ClientError as e:
         logger.error( '## DynamoDB Client Exception' )
         logger.error( e.response[ 'Error' ][ 'Message' ] )
     else:
-        # Clean response
-        for i in response[ 'Items' ]:
-            delete_object( bucket_name, i[ 'messageId' ] )
-            delete_email_item( destination, i[ 'messageId' ] )
+        if message_ids:
+            delete_objects( bucket_name, message_ids )
+            delete_email_items( destination, message_ids )
+
+
+def cleanup_address( address ):
+    """
+    Deletes all emails and redirect addresses of a disposable address
+
+    :param address: disposable address
+    """
+    delete_emails( address )
+    delete_reply_address_item( address )
+
+
+def get_expired_addresses( now ):
+    """
+    Queries every partition of the ttl-index for addresses that expired before a given time
+
+    :param now: unix timestamp, addresses with a lower ttl are expired
+    :return: generator of expired disposable addresses
+    :raises ClientError: DynamoDB client error
+    """
+    for gc_bucket in range( gc_buckets ):
+        for i in query_items(
+                addresses_table,
+                IndexName = 'ttl-index',
+                KeyConditionExpression = "gc_bucket = :b AND #t < :now",
+                ExpressionAttributeNames = { "#t": "ttl" },
+                ExpressionAttributeValues = { ":b": gc_bucket, ":now": now },
+                ProjectionExpression = "address"
+        ):
+            yield i[ 'address' ]
 
 
 def cleanup( ):
     """
     Deletes all disposable addresses, emails from the database and Bucket, that are expired
+    Expired addresses are handed to the workers while the remaining result pages are still being fetched
 
     :raises ClientError: DynamoDB client error
     """
-    try:
-        response = addresses_table.scan(
-                FilterExpression = Attr( 'ttl' ).lt( int( time.time( ) ) ),
-                ProjectionExpression = "address"
-        )
-    except ClientError as e:
-        logger.error( '## DynamoDB Client Exception' )
-        logger.error( e.response[ 'Error' ][ 'Message' ] )
-    else:
-        for i in response[ 'Items' ]:
-            delete_emails( i[ 'address' ] )
-            delete_address_item( i[ 'address' ] )
-            delete_reply_address_item( i[ 'address' ] )
+    expired_addresses = [ ]
+    futures = [ ]
+    with ThreadPoolExecutor( max_workers = cleanup_workers ) as executor:
+        try:
+            for address in get_expired_addresses( int( time.time( ) ) ):
+                if not expired_addresses:
+                    get_s3_client( )
+                expired_addresses.append( address )
+                futures.append( executor.submit( cleanup_address, address ) )
+        except ClientError as e:
+            logger.error( '## DynamoDB Client Exception' )
+            logger.error( e.response[ 'Error' ][ 'Message' ] )
+        for future in futures:
+            future.result( )
+    if expired_addresses:
+        delete_address_items( expired_addresses )
 
 
 def lambda_handler( event, context ):
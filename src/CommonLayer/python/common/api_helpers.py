@@ -0,0 +1,49 @@
+import json
+import os
+
+cors_allowed_origins = tuple( os.environ[ 'cors_allowed_origins' ].split( ',' ) )
+default_allowed_origin = cors_allowed_origins[ 0 ]
+cors_allowed_origins_set = frozenset( cors_allowed_origins )
+
+# response headers that are the same for every request, only the allowed origin is added per request
+base_headers = {
+    "access-control-allow-headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
+    "access-control-allow-methods": "GET,OPTIONS,POST"
+}
+
+
+def get_allowed_origins( origin ):
+    """
+    Gets the allowed origins from the environment and checks if a given origin is allowed
+    :param origin: the origin to check
+    :return: origin if allowed, else default origin
+    """
+    if origin in cors_allowed_origins_set:
+        return origin
+    return default_allowed_origin
+
+
+def response_headers( origin ):
+    """
+    Builds the CORS headers of a response
+    :param origin: the origin of the request
+    :return: the response headers
+    """
+    return { **base_headers, "access-control-allow-origin": get_allowed_origins( origin ) }
+
+
+def parse_body( raw_body ):
+    """
+    parse the JSON body of a request
+    :param raw_body: the body of the API Gateway event, None if the request has no body
+    :return: the parsed body, an empty dict if it is missing or not a JSON object
+    """
+    if not raw_body:
+        return { }
+    try:
+        body = json.loads( raw_body )
+    except ValueError:
+        return { }
+    if not isinstance( body, dict ):
+        return { }
+    return body
@@ -0,0 +1,11 @@
+from botocore.config import Config
+
+# keep connections to AWS alive between invocations and allow enough of them for concurrent requests
+boto_config = Config(
+        max_pool_connections = 50,
+        tcp_keepalive = True,
+        retries = { 'mode': 'adaptive', 'max_attempts': 5 }
+)
+
+# functions on the mail path retry less, SES and the sender are waiting on them
+mail_boto_config = boto_config.merge( Config( retries = { 'mode': 'standard', 'max_attempts': 3 } ) )
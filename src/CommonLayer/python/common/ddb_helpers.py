@@ -0,0 +1,50 @@
+from botocore.exceptions import ClientError
+import logging
+import time
+from functools import lru_cache
+
+logger = logging.getLogger( )
+
+# number of partitions of the ttl-index, addresses are stored with gc_bucket = ttl % gc_buckets
+gc_buckets = 16
+
+# address owners are cached for up to this many seconds within a warm container
+owner_cache_seconds = 30
+
+
+@lru_cache( maxsize = 512 )
+def get_address_owner( address_table, address, time_window ):
+    """
+    get the owner of a given address, cached per warm container
+    the lookup uses the client of the table, it is thread safe unlike the Table resource
+    :param address_table: the DynamoDB addresses table
+    :param address: the disposable address to look up
+    :param time_window: current time divided by owner_cache_seconds, only used as part of the cache key
+    :return: the username the address belongs to, None if the address does not exist
+    :raises ClientError: DynamoDB Client Exception
+    """
+    response = address_table.meta.client.get_item(
+            TableName = address_table.name,
+            Key = {
+                'address': address
+            },
+            ProjectionExpression = "username"
+    )
+    return response.get( 'Item', { } ).get( 'username' )
+
+
+def user_owns_address( address_table, address, username ):
+    """
+    check if a given address belongs to a given user
+    :param address_table: the DynamoDB addresses table
+    :param address: the disposable address to check
+    :param username: the username to check against
+    :return: True if the address belongs to the user, False otherwise
+    """
+    try:
+        owner = get_address_owner( address_table, address, int( time.time( ) // owner_cache_seconds ) )
+    except ClientError as e:
+        logger.info( '## DynamoDB Client Exception' )
+        logger.info( e.response[ 'Error' ][ 'Message' ] )
+        return False
+    return owner is not None and owner == username
@@ -0,0 +1,20 @@
+import logging
+import os
+
+logger = logging.getLogger( )
+
+
+def log_environment( ):
+    """
+    Logs the environment variables, they do not change between invocations so once per cold start is enough
+    """
+    logger.info( '## ENVIRONMENT VARIABLES' )
+    logger.info( os.environ )
+
+
+def log_event( event ):
+    """
+    Logs an invocation event, events can be large so they are only logged when the level is lowered to DEBUG
+    :param event: the lambda event
+    """
+    logger.debug( '## EVENT %s', event )
@@ -1,5 +1,4 @@
 import boto3
-from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
 import json
 import os
@@ -7,117 +6,114 @@ import logging
 import time
 import re
 
+from common.api_helpers import default_allowed_origin, response_headers
+from common.boto_helpers import boto_config
+from common.ddb_helpers import gc_buckets
 from random_values import return_random_address
 
 logger = logging.getLogger( )
 logger.setLevel( logging.INFO )
 
-dynamodb = boto3.resource( "dynamodb" )
+dynamodb = boto3.resource( "dynamodb", config = boto_config )
 addresses_table = dynamodb.Table( os.environ[ 'addresses_table_name' ] )
 
-valid_domains = os.environ[ 'valid_domains' ].split( ',' )
+valid_domains = tuple( os.environ[ 'valid_domains' ].split( ',' ) )
+valid_domains_set = frozenset( valid_domains )
 mailboxTTL = int( os.environ[ 'mailbox_ttl' ] )
 
-cors_allowed_origins = os.environ[ 'cors_allowed_origins' ].split( ',' )
-default_allowed_origin = cors_allowed_origins[ 0 ]
+email_pattern = re.compile( '^.+@(\\[?)[a-zA-Z0-9\\-.]+\\.([a-zA-Z]{2,3}|[0-9]{1,3})(]?)$' )
 
-
-def address_exists( address ):
-    """
-    check if a given address exists
-    :param address:
-    :return:
-    """
-    try:
-        response = addresses_table.get_item(
-                Key = {
-                    'address': address
-                }
-        )
-    except ClientError as e:
-        logger.info( '## DynamoDB Client Exception' )
-        logger.info( e.response[ 'Error' ][ 'Message' ] )
-    else:
-        if 'Item' in response:
-            item = response[ 'Item' ]
-            if item[ 'ttl' ] > int( time.time( ) ):
-                return True
-    return False
+# how many random names to try before giving up
+random_address_attempts = 10
 
 
-def user_owns_address( address, username ):
+def get_address( address ):
     """
-    check if a given address belongs to a given user
-    :param address: the disposable address to check
-    :param username: the username to check against
-    :return: True if the address belongs to the user, False otherwise
-    :raises ClientError: DynamoDB Client Exception
+    get the ttl and owner of a given address
+    :param address: the disposable address to get
+    :return: the address item with ttl and username, None if it does not exist
     """
     try:
         response = addresses_table.get_item(
                 Key = {
                     'address': address
-                }
+                },
+                ProjectionExpression = "#t, username",
+                ExpressionAttributeNames = { "#t": "ttl" }
         )
     except ClientError as e:
         logger.info( '## DynamoDB Client Exception' )
         logger.info( e.response[ 'Error' ][ 'Message' ] )
     else:
-        if 'Item' in response:
-            item = response[ 'Item' ]
-            if item[ 'username' ] == username:
-                return True
-    return False
+        return response.get( 'Item' )
+    return None
 
 
-def create_address( address, username, redirect_address ):
+def create_address( address, username, redirect_address, now, only_if_unused = False ):
     """
     create a new disposable address
     :param address: the new disposable address
     :param username: the username to associate with the address
     :param redirect_address: the address to redirect to
-    :raises ClientError: DynamoDB Client Exception
+    :param now: current unix timestamp
+    :param only_if_unused: only create the address if it does not exist yet or is expired
+    :return: True if the address was created, False otherwise
     """
-    ttl = int( time.time( ) ) + mailboxTTL
+    ttl = now + mailboxTTL
+    put_args = {
+        'Item': {
+            'address':        address,
+            'ttl':            ttl,
+            'gc_bucket':      ttl % gc_buckets,
+            'username':       username,
+            'redirect_email': redirect_address,
+            'redirect':       True
+        }
+    }
+    if only_if_unused:
+        put_args[ 'ConditionExpression' ] = "attribute_not_exists(address) OR #t <= :now"
+        put_args[ 'ExpressionAttributeNames' ] = { "#t": "ttl" }
+        put_args[ 'ExpressionAttributeValues' ] = { ":now": now }
     try:
-        addresses_table.put_item(
-                Item = {
-                    'address':        address,
-                    'ttl':            ttl,
-                    'username':       username,
-                    'redirect_email': redirect_address,
-                    'redirect':       True
-                }
-        )
+        addresses_table.put_item( **put_args )
     except ClientError as e:
-        logger.info( '## DynamoDB Client Exception' )
-        logger.info( e.response[ 'Error' ][ 'Message' ] )
+        if e.response[ 'Error' ][ 'Code' ] != 'ConditionalCheckFailedException':
+            logger.info( '## DynamoDB Client Exception' )
+            logger.info( e.response[ 'Error' ][ 'Message' ] )
+        return False
+    return True
 
 
-def get_all_addresses( username ):
+def get_all_addresses( username, now ):
     """
     get all addresses for a given user
     :param username: the username to get addresses for
+    :param now: current unix timestamp, expired addresses are left out
     :return: a list of addresses with TTLs, redirect addresses, and redirect flags
     """
     addresses = [ ]
-    ttl = int( time.time( ) )
+    scan_args = {
+        'FilterExpression':          "username = :u AND #t > :now",
+        'ExpressionAttributeNames':  { "#t": "ttl" },
+        'ExpressionAttributeValues': { ":u": username, ":now": now }
+    }
     try:
-        response = addresses_table.scan(
-                FilterExpression = Attr( 'username' ).eq( username ) & Attr( 'ttl' ).gt( ttl )
-        )
+        while True:
+            response = addresses_table.scan( **scan_args )
+            for item in response[ 'Items' ]:
+                addresses.append(
+                        {
+                            'address':        item[ 'address' ],
+                            'ttl':            str( item[ 'ttl' ] ),
+                            "redirect":       item[ "redirect" ],
+                            "redirect_email": item[ "redirect_email" ]
+                        } )
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_args[ 'ExclusiveStartKey' ] = response[ 'LastEvaluatedKey' ]
     except ClientError as e:
         logger.info( '## DynamoDB Client Exception' )
         logger.info( e.response[ 'Error' ][ 'Message' ] )
-    else:
-        for item in response[ 'Items' ]:
-            addresses.append(
-                    {
-                        'address':        item[ 'address' ],
-                        'ttl':            str( item[ 'ttl' ] ),
-                        "redirect":       item[ "redirect" ],
-                        "redirect_email": item[ "redirect_email" ]
-                    } )
     return addresses
 
 
@@ -127,35 +123,29 @@ def validate_email( address ):
     :param address: the email address to validate
     :return: True if the email address is valid, False otherwise
     """
-    if type( address ) is not str:
+    if not isinstance( address, str ):
         return False
-    if re.match( '^.+@(\\[?)[a-zA-Z0-9\\-.]+\\.([a-zA-Z]{2,3}|[0-9]{1,3})(]?)$', address ) is not None:
+    if email_pattern.match( address ) is not None:
         domain = address.split( '@' )[ 1 ]
-        if domain in valid_domains:
+        if domain in valid_domains_set:
             return True
     return False
 
 
-def generate_unique_random_email( ):
+def create_random_address( username, redirect_address, now ):
     """
-    generate a unique random email address
-    :return: a unique random email address in the format lastname.firstname.99@valid_domain
+    create a new disposable address with a unique random name
+    the existence check is part of the write, so a free name costs a single request
+    :param username: the username to associate with the address
+    :param redirect_address: the address to redirect to
+    :param now: current unix timestamp
+    :return: the new address in the format lastname.firstname.99@valid_domain, None if no address could be created
     """
-    email_address = return_random_address( ) + '@' + valid_domains[ 0 ]
-    while address_exists( email_address ):
+    for _ in range( random_address_attempts ):
         email_address = return_random_address( ) + '@' + valid_domains[ 0 ]
-    return email_address
-
-
-def get_allowed_origins( origin ):
-    """
-    Gets the allowed origins from the environment and checks if a given origin is allowed
-    :param origin: the origin to check
-    :return: origin if allowed, else default origin
-    """
-    if origin in cors_allowed_origins:
-        return origin
-    return default_allowed_origin
+        if create_address( email_address, username, redirect_address, now, only_if_unused = True ):
+            return email_address
+    return None
 
 
 def lambda_handler( event, context ):
@@ -172,11 +162,7 @@ def lambda_handler( event, context ):
             'cognito:username' )
     user_email = event.get( 'requestContext', { } ).get( 'authorizer', { } ).get( 'claims', { } ).get( 'email' )
 
-    headers = {
-        "access-control-allow-headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-        "access-control-allow-methods": "GET,OPTIONS,POST",
-        "access-control-allow-origin":  get_allowed_origins( origin )
-    }
+    headers = response_headers( origin )
 
     message = "missing or invalid parameters"
     result = { "statusCode": 400,
@@ -188,23 +174,35 @@ def lambda_handler( event, context ):
         return result
 
     disposable_address = event.get( 'queryStringParameters', { } ).get( 'address' )
+    now = int( time.time( ) )
 
     if disposable_address == "random" or validate_email( disposable_address ):
         if disposable_address == "random":
-            disposable_address = generate_unique_random_email( )
-            create_address( disposable_address, username, user_email )
+            disposable_address = create_random_address( username, user_email, now )
             message = "random email address created"
-        elif address_exists( disposable_address ):
-            if user_owns_address( disposable_address, username ):
+        else:
+            # one read answers both, whether the address is taken and who owns it
+            address_item = get_address( disposable_address )
+            if address_item is None or address_item[ 'ttl' ] <= now:
+                # the address may have been claimed since it was read, only create it if it is still unused
+                if create_address( disposable_address, username, user_email, now, only_if_unused = True ):
+                    message = "email address created"
+                else:
+                    message = "email address could not be created, creating random address"
+                    disposable_address = create_random_address( username, user_email, now )
+            elif address_item[ 'username' ] == username:
                 message = "email address already exists"
             else:
                 message = "email address already exists and is owned by another user, " \
                           "creating random address"
-                disposable_address = generate_unique_random_email( )
-                create_address( disposable_address, username, user_email )
-        else:
-            create_address( disposable_address, username, user_email )
-            message = "email address created"
+                disposable_address = create_random_address( username, user_email, now )
+
+        if disposable_address is None:
+            result = { "statusCode": 500,
+                       "body":       json.dumps( { "message": "could not create email address" } ),
+                       "headers":    headers
+                       }
+            return result
 
         result = {
             "statusCode": 200,
@@ -212,7 +210,7 @@ def lambda_handler( event, context ):
                     {
                         "message":      message,
                         "address":      disposable_address,
-                        "allAddresses": get_all_addresses( username ) } ),
+                        "allAddresses": get_all_addresses( username, now ) } ),
             "headers":    headers
         }
 
@@ -1,4 +1,4 @@
-import random
+import os
 
 
 def return_random_address( ):
@@ -6,14 +6,12 @@ def return_random_address( ):
     Returns a random email address
     :return: str - random email address
     """
-    return random.choice( surnames ) \
-           + '.' \
-           + random.choice( first_names ) \
-           + '.' \
-           + str( random.randint( 10, 99 ) )
+    # one random byte each for surname, first name and number
+    b = os.urandom( 3 )
+    return f"{ surnames[ b[ 0 ] % len( surnames ) ] }.{ first_names[ b[ 1 ] % len( first_names ) ] }.{ 10 + b[ 2 ] % 90 }"
 
 
-surnames = [
+surnames = (
     'Smith', 'Johnson', 'Williams', 'Jones', 'Brown', 'Davis', 'Miller', 'Wilson', 'Moore', 'Taylor', 'Anderson',
     'Thomas', 'Jackson', 'White', 'Harris', 'Martin', 'Thompson', 'Garcia', 'Martinez', 'Robinson', 'Clark',
     'Rodriguez', 'Lewis', 'Lee', 'Walker', 'Hall', 'Allen', 'Young', 'Hernandez', 'King', 'Wright', 'Lopez', 'Hill',
@@ -24,9 +22,9 @@ surnames = [
     'Barnes', 'Ross', 'Henderson', 'Coleman', 'Jenkins', 'Perry', 'Powell', 'Long', 'Patterson', 'Hughes', 'Flores',
     'Washington', 'Butler', 'Simmons', 'Foster', 'Gonzales', 'Bryant', 'Alexander', 'Russell', 'Griffin', 'Diaz',
     'Hayes', 'Myers', 'Ford', 'Hamilton', 'Graham', 'Sullivan', 'Wallace', 'Woods', 'Cole', 'West', 'Jordan'
-]
+)
 
-first_names = [
+first_names = (
     'James', 'John', 'Robert', 'Michael', 'William', 'David', 'Richard', 'Charles', 'Joseph', 'Thomas', 'Christopher',
     'Daniel', 'Paul', 'Mark', 'Donald', 'George', 'Kenneth', 'Steven', 'Edward', 'Brian', 'Ronald', 'Anthony', 'Kevin',
     'Jason', 'Matthew', 'Gary', 'Timothy', 'Jose', 'Larry', 'Jeffrey', 'Frank', 'Scott', 'Eric', 'Stephen', 'Andrew',
@@ -37,4 +35,4 @@ first_names = [
     'Russell', 'Bobby', 'Victor', 'Martin', 'Ernest', 'Phillip', 'Todd', 'Jesse', 'Craig', 'Alan', 'Shawn', 'Clarence',
     'Sean', 'Philip', 'Chris', 'Johnny', 'Earl', 'Jimmy', 'Antonio', 'Danny', 'Bryan', 'Tony', 'Luis', 'Mike',
     'Stanley', 'Leonard', 'Nathan', 'Dale', 'Manuel', 'Rodney', 'Curtis', 'Norman', 'Alen', 'Marvin', 'Vincent', 'Glen'
-]
+)
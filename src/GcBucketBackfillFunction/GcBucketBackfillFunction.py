@@ -0,0 +1,87 @@
+# one-off migration, run by a CDK trigger after deployments that change this function.
+# addresses created before the ttl-index have no gc_bucket and would never be found by the CleanUpFunction
+import boto3
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+import os
+import logging
+
+from common.ddb_helpers import gc_buckets
+
+logger = logging.getLogger( )
+logger.setLevel( logging.INFO )
+
+# the table is scanned in this many parallel segments, one worker each
+scan_segments = 8
+
+# the client is shared by the workers, Table resources are not thread safe
+dynamodb_client = boto3.resource( "dynamodb" ).meta.client
+addresses_table_name = os.environ[ 'addresses_table_name' ]
+
+
+def set_gc_bucket( address, ttl ):
+    """
+    Sets the gc_bucket of an address that was created before the ttl-index existed
+    :param address: the disposable address to update
+    :param ttl: the current ttl of the address
+    :return: True if the address was updated, False if it was deleted or got a gc_bucket in the meantime
+    :raises ClientError: DynamoDB client error
+    """
+    try:
+        dynamodb_client.update_item(
+                TableName = addresses_table_name,
+                Key = {
+                    'address': address
+                },
+                UpdateExpression = "SET gc_bucket = :b",
+                ConditionExpression = "attribute_exists( address ) AND attribute_not_exists( gc_bucket )",
+                ExpressionAttributeValues = { ":b": ttl % gc_buckets }
+        )
+    except ClientError as e:
+        if e.response[ 'Error' ][ 'Code' ] != 'ConditionalCheckFailedException':
+            raise
+        return False
+    return True
+
+
+def backfill_segment( segment ):
+    """
+    Sets the gc_bucket of every address in one scan segment that does not have one yet
+    :param segment: the scan segment to process
+    :return: the number of updated addresses
+    :raises ClientError: DynamoDB client error
+    """
+    updated = 0
+    scan_args = {
+        'TableName':                addresses_table_name,
+        'Segment':                  segment,
+        'TotalSegments':            scan_segments,
+        'FilterExpression':         "attribute_not_exists( gc_bucket ) AND attribute_exists( #t )",
+        'ProjectionExpression':     "address, #t",
+        'ExpressionAttributeNames': { "#t": "ttl" }
+    }
+    while True:
+        response = dynamodb_client.scan( **scan_args )
+        for item in response[ 'Items' ]:
+            if set_gc_bucket( item[ 'address' ], item[ 'ttl' ] ):
+                updated += 1
+        if 'LastEvaluatedKey' not in response:
+            return updated
+        scan_args[ 'ExclusiveStartKey' ] = response[ 'LastEvaluatedKey' ]
+
+
+def lambda_handler( event, context ):
+    logger.info( '## ENVIRONMENT VARIABLES' )
+    logger.info( os.environ )
+    logger.info( '## EVENT' )
+    logger.info( event )
+
+    try:
+        with ThreadPoolExecutor( max_workers = scan_segments ) as executor:
+            updated = sum( executor.map( backfill_segment, range( scan_segments ) ) )
+    except ClientError as e:
+        logger.error( '## DynamoDB Client Exception' )
+        logger.error( e.response[ 'Error' ][ 'Message' ] )
+        raise
+    logger.info( '## UPDATED ADDRESSES' )
+    logger.info( updated )
@@ -1,22 +1,31 @@
+import base64
 import boto3
 from botocore.exceptions import ClientError
 import json
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from common.api_helpers import default_allowed_origin, response_headers
+from common.boto_helpers import boto_config
+from common.ddb_helpers import user_owns_address
 
 logger = logging.getLogger( )
 logger.setLevel( logging.INFO )
 
-dynamodb = boto3.resource( "dynamodb" )
+dynamodb = boto3.resource( "dynamodb", config = boto_config )
 emails_table = dynamodb.Table( os.environ[ 'emails_table_name' ] )
 address_table = dynamodb.Table( os.environ[ 'addresses_table_name' ] )
 
-cors_allowed_origins = os.environ[ 'cors_allowed_origins' ].split( ',' )
-default_allowed_origin = cors_allowed_origins[ 0 ]
+# Table resources are not thread safe, requests that run on the executor use the client of the resource
+dynamodb_client = dynamodb.meta.client
 
 bucket_name = os.environ[ 'emails_bucket_name' ]
 
-s3 = boto3.client( 's3' )
+s3 = boto3.client( 's3', config = boto_config )
+
+# runs the independent DynamoDB and S3 requests of an invocation concurrently
+executor = ThreadPoolExecutor( max_workers = 3 )
 
 
 def get_email_data( destination, message_id ):
@@ -28,11 +37,13 @@ def get_email_data( destination, message_id ):
     """
     result = None
     try:
-        response = emails_table.get_item(
+        response = dynamodb_client.get_item(
+                TableName = emails_table.name,
                 Key = {
                     'destination': destination,
                     'messageId':   message_id
-                }
+                },
+                ProjectionExpression = "messageId, isNew"
         )
     except ClientError as e:
         logger.info( '## DynamoDB Client Exception' )
@@ -43,29 +54,28 @@ def get_email_data( destination, message_id ):
     return result
 
 
-def user_owns_address( address, username ):
+def get_email_object( message_id ):
     """
-    check if a given address belongs to a given user
-    :param address: the disposable address to check
-    :param username: the username to check against
-    :return: True if the address belongs to the user, False otherwise
-    :raises ClientError: DynamoDB Client Exception
+    starts the download of a raw email from the email bucket
+    :param message_id: the message ID ( message id is the same as the object key in S3 )
+    :return: the S3 get_object response, None if the object could not be retrieved
     """
     try:
-        response = address_table.get_item(
-                Key = {
-                    'address': address
-                }
-        )
+        return s3.get_object( Bucket = bucket_name, Key = message_id )
     except ClientError as e:
-        logger.info( '## DynamoDB Client Exception' )
+        logger.info( '## S3 Client Exception' )
         logger.info( e.response[ 'Error' ][ 'Message' ] )
-    else:
-        if 'Item' in response:
-            item = response[ 'Item' ]
-            if item[ 'username' ] == username:
-                return True
-    return False
+    return None
+
+
+def close_email_object( future ):
+    """
+    closes the body of an S3 response that is not going to be read
+    :param future: the future of a get_email_object call
+    """
+    data = future.result( )
+    if data is not None:
+        data[ 'Body' ].close( )
 
 
 def set_as_read( destination, message_id ):
@@ -76,7 +86,8 @@ def set_as_read( destination, message_id ):
     :raises ClientError: DynamoDB Client Exception
     """
     try:
-        emails_table.update_item(
+        dynamodb_client.update_item(
+                TableName = emails_table.name,
                 Key = {
                     'destination': destination,
                     'messageId':   message_id
@@ -89,15 +100,17 @@ def set_as_read( destination, message_id ):
         logger.info( e.response[ 'Error' ][ 'Message' ] )
 
 
-def get_allowed_origins( origin ):
+def accepts_raw_email( event ):
     """
-    Gets the allowed origins from the environment and checks if a given origin is allowed
-    :param origin: the origin to check
-    :return: origin if allowed, else default origin
+    check if the client asked for the raw message bytes
+    API Gateway only decodes base64 bodies for requests that accept a binary media type
+    :param event: the API Gateway event
+    :return: True if the Accept header includes message/rfc822, False otherwise
     """
-    if origin in cors_allowed_origins:
-        return origin
-    return default_allowed_origin
+    for name, value in ( event.get( 'headers' ) or { } ).items( ):
+        if name.lower( ) == 'accept':
+            return 'message/rfc822' in value
+    return False
 
 
 def lambda_handler( event, context ):
@@ -111,11 +124,7 @@ def lambda_handler( event, context ):
         'cognito:username' )
     user_email = event.get( 'requestContext', { } ).get( 'authorizer', { } ).get( 'claims', { } ).get( 'email' )
 
-    headers = {
-        "access-control-allow-headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-        "access-control-allow-methods": "GET,OPTIONS,POST",
-        "access-control-allow-origin":  get_allowed_origins( origin )
-    }
+    headers = response_headers( origin )
 
     result = { "statusCode": 400, "body": json.dumps( { "body": "missing parameters" } ), "headers": headers }
 
@@ -125,23 +134,45 @@ def lambda_handler( event, context ):
     disposable_address = event.get( 'pathParameters', { } ).get( 'destination' )
     message_id = event.get( 'pathParameters', { } ).get( 'messageId' )
 
-    if None not in [ disposable_address, message_id ] \
-            and user_owns_address( disposable_address, username ):
-        email_file = get_email_data( disposable_address, message_id )
-        if email_file is not None:
-            data = s3.get_object(
-                    Bucket = bucket_name, Key = email_file.get( 'messageId' ) )
-            contents = data.get( "Body" ).read( ).decode( 'utf-8' )
-            headers.update( { "content-type": "message/rfc822" } )
-            result = {
-                "statusCode": 200,
-                "headers":    headers,
-                "body":       contents
-            }
+    if None in [ disposable_address, message_id ]:
+        return result
+
+    # the lookups do not depend on each other, the S3 object is only returned once ownership is confirmed
+    owner_future = executor.submit( user_owns_address, address_table, disposable_address, username )
+    email_future = executor.submit( get_email_data, disposable_address, message_id )
+    object_future = executor.submit( get_email_object, message_id )
+
+    if owner_future.result( ):
+        email_file = email_future.result( )
+        data = object_future.result( )
+        if email_file is not None and data is not None:
+            # mark the email as read while the body is downloaded. The update is awaited before returning,
+            # a request still running when the handler returns is frozen with the sandbox and may be lost
+            read_future = None
             if email_file.get( 'isNew' ):
-                set_as_read( disposable_address, message_id )
-        else:
-            result = { "statusCode": 401, "body": json.dumps( { "message": "not found" } ),
-                       "headers":    headers }
+                read_future = executor.submit( set_as_read, disposable_address, message_id )
+            contents = data.get( "Body" ).read( )
+            headers.update( { "content-type": "message/rfc822" } )
+            if accepts_raw_email( event ):
+                # the raw message is passed on as is, API Gateway decodes it for message/rfc822 requests
+                result = {
+                    "statusCode":      200,
+                    "headers":         headers,
+                    "body":            base64.b64encode( contents ).decode( 'ascii' ),
+                    "isBase64Encoded": True
+                }
+            else:
+                # clients that do not ask for message/rfc822 keep getting the message as text
+                result = {
+                    "statusCode": 200,
+                    "headers":    headers,
+                    "body":       contents.decode( 'utf-8', errors = 'replace' )
+                }
+            if read_future is not None:
+                read_future.result( )
+            return result
+        result = { "statusCode": 401, "body": json.dumps( { "message": "not found" } ),
+                   "headers":    headers }
 
+    object_future.add_done_callback( close_email_object )
     return result
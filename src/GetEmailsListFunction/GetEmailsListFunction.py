@@ -1,70 +1,44 @@
 import boto3
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key
 import json
 import os
 import logging
 
+from common.api_helpers import default_allowed_origin, response_headers
+from common.boto_helpers import boto_config
+from common.ddb_helpers import user_owns_address
+
 logger = logging.getLogger( )
 logger.setLevel( logging.INFO )
 
-dynamodb = boto3.resource( "dynamodb" )
+dynamodb = boto3.resource( "dynamodb", config = boto_config )
 emails_table = dynamodb.Table( os.environ[ 'emails_table_name' ] )
 address_table = dynamodb.Table( os.environ[ 'addresses_table_name' ] )
 
-cors_allowed_origins = os.environ[ 'cors_allowed_origins' ].split( ',' )
-default_allowed_origin = cors_allowed_origins[ 0 ]
-
 
 def get_emails( destination ):
     items = None
+    query_args = {
+        'KeyConditionExpression':    "destination = :d",
+        'ExpressionAttributeValues': { ":d": destination }
+    }
+    emails = [ ]
     try:
-        filtering_exp = Key( 'destination' ).eq( destination )
-        response = emails_table.query( KeyConditionExpression = filtering_exp )
+        # a single query returns at most 1 MB, follow the pages until all emails are read
+        while True:
+            response = emails_table.query( **query_args )
+            emails.extend( response[ 'Items' ] )
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_args[ 'ExclusiveStartKey' ] = response[ 'LastEvaluatedKey' ]
     except ClientError as e:
         logger.info( '## DynamoDB Client Exception' )
         logger.info( e.response[ 'Error' ][ 'Message' ] )
     else:
-        items = { 'items': response[ 'Items' ], 'count': response[ 'Count' ] }
+        items = { 'items': emails, 'count': len( emails ) }
     return items
 
 
-def user_owns_address( address, username ):
-    """
-    check if a given address belongs to a given user
-    :param address: the disposable address to check
-    :param username: the username to check against
-    :return: True if the address belongs to the user, False otherwise
-    :raises ClientError: DynamoDB Client Exception
-    """
-    try:
-        response = address_table.get_item(
-                Key = {
-                    'address': address
-                }
-        )
-    except ClientError as e:
-        logger.info( '## DynamoDB Client Exception' )
-        logger.info( e.response[ 'Error' ][ 'Message' ] )
-    else:
-        if 'Item' in response:
-            item = response[ 'Item' ]
-            if item[ 'username' ] == username:
-                return True
-    return False
-
-
-def get_allowed_origins( origin ):
-    """
-    Gets the allowed origins from the environment and checks if a given origin is allowed
-    :param origin: the origin to check
-    :return: origin if allowed, else default origin
-    """
-    if origin in cors_allowed_origins:
-        return origin
-    return default_allowed_origin
-
-
 def lambda_handler( event, context ):
     logger.info( '## ENVIRONMENT VARIABLES' )
     logger.info( os.environ )
@@ -78,11 +52,7 @@ def lambda_handler( event, context ):
 
     disposable_address = event.get( 'pathParameters', { } ).get( 'destination' )
 
-    headers = {
-        "access-control-allow-headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-        "access-control-allow-methods": "GET,OPTIONS,POST",
-        "access-control-allow-origin":  get_allowed_origins( origin )
-    }
+    headers = response_headers( origin )
 
     result = { "statusCode": 400,
                "body":       json.dumps( { "message": "missing or invalid parameters" } ),
@@ -92,7 +62,7 @@ def lambda_handler( event, context ):
     if None in [ username, user_email, disposable_address ]:
         return result
 
-    if user_owns_address( disposable_address, username ):
+    if user_owns_address( address_table, disposable_address, username ):
         items = get_emails( disposable_address )
         result = { "statusCode": 200, "body": json.dumps( items ), "headers": headers }
 
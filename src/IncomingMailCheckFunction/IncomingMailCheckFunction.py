@@ -4,52 +4,97 @@ import os
 import logging
 import time
 
+from common.boto_helpers import mail_boto_config
+from common.log_helpers import log_environment, log_event
+
 logger = logging.getLogger( )
 logger.setLevel( logging.INFO )
 
-dynamodb = boto3.resource( "dynamodb" )
+log_environment( )
+
+dynamodb = boto3.resource( "dynamodb", config = mail_boto_config )
 addresses_table = dynamodb.Table( os.environ[ 'addresses_table_name' ] )
 reply_addresses_table = dynamodb.Table( os.environ[ 'reply_addresses_table_name' ] )
 
+# address -> ( exists, cached until ), lets warm containers answer repeated recipients without DynamoDB.
+# existing addresses are cached up to a minute but never past their ttl, unknown ones for a few seconds
+address_cache = { }
+address_cache_seconds = 60
+missing_address_cache_seconds = 10
+address_cache_size = 10000
+
+# unprocessed keys are requested again up to this many times, waiting twice as long before each attempt
+batch_get_retries = 3
+batch_get_backoff_seconds = 0.05
+
+
+def lookup_address( address, now ):
+    """
+    Look up a given address in the addresses and reply addresses tables.
+    :param address: The disposable email address to check.
+    :param now: The current unix timestamp.
+    :return: Tuple of True if the address exists and is not expired, False otherwise,
+             and the timestamp until which this result may be cached.
+    :raises: ClientError if the DynamoDB query fails or keys are still unprocessed after the last retry.
+    """
+    # both tables are read with a single BatchGetItem request
+    request_items = {
+        addresses_table.name:       { 'Keys': [ { 'address': address } ] },
+        reply_addresses_table.name: { 'Keys': [ { 'proxyAddress': address } ] }
+    }
+    items = { addresses_table.name: [ ], reply_addresses_table.name: [ ] }
+    for attempt in range( batch_get_retries + 1 ):
+        if attempt:
+            time.sleep( batch_get_backoff_seconds * 2 ** attempt )
+        response = dynamodb.batch_get_item( RequestItems = request_items )
+        for table_name, table_items in response[ 'Responses' ].items( ):
+            items[ table_name ].extend( table_items )
+        request_items = response.get( 'UnprocessedKeys' )
+        if not request_items:
+            break
+    else:
+        raise ClientError(
+                { 'Error': { 'Code':    'ProvisionedThroughputExceededException',
+                             'Message': 'keys still unprocessed after %d retries' % batch_get_retries } },
+                'BatchGetItem' )
+
+    for item in items[ addresses_table.name ]:
+        if item[ 'ttl' ] > now:
+            return True, min( item[ 'ttl' ], now + address_cache_seconds )
+
+    if items[ reply_addresses_table.name ]:
+        return True, now + address_cache_seconds
+
+    return False, now + missing_address_cache_seconds
+
 
 def address_exists( address ):
     """
     Check if a given disposable email address exists in the database and is not expired.
+    Results are cached within a warm container, see address_cache.
     :param address: The disposable email address to check.
     :return: True if the address exists and is not expired, False otherwise.
-    :raises: ClientError if the DynamoDB query fails.
     """
-    try:
-        response = addresses_table.get_item(
-                Key = {
-                    'address': address
-                }
-        )
-        if 'Item' in response:
-            item = response[ 'Item' ]
-            if item[ 'ttl' ] > int( time.time( ) ):
-                return True
-
-        response = reply_addresses_table.get_item(
-                Key = {
-                    'proxyAddress': address
-                }
-        )
-        if 'Item' in response:
-            return True
+    now = int( time.time( ) )
+    cached = address_cache.get( address )
+    if cached is not None and cached[ 1 ] > now:
+        return cached[ 0 ]
 
+    try:
+        exists, cache_until = lookup_address( address, now )
     except ClientError as e:
         logger.info( '## DynamoDB Client Exception' )
         logger.info( e.response[ 'Error' ][ 'Message' ] )
+        return False
 
-    return False
+    if len( address_cache ) >= address_cache_size:
+        address_cache.clear( )
+    address_cache[ address ] = ( exists, cache_until )
+    return exists
 
 
 def lambda_handler( event, context ):
-    logger.info( '## ENVIRONMENT VARIABLES' )
-    logger.info( os.environ )
-    logger.info( '## EVENT' )
-    logger.info( event )
+    log_event( event )
 
     for record in event[ 'Records' ]:
         to_address = record[ 'ses' ][ 'mail' ][ 'destination' ][ 0 ]
@@ -1,9 +1,5 @@
 import base64
 import json
-from email import encoders
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 
 import boto3
 from botocore.exceptions import ClientError
@@ -11,17 +7,28 @@ import os
 import logging
 import time
 
+from common.api_helpers import base_headers, default_allowed_origin, get_allowed_origins, parse_body
+from common.boto_helpers import mail_boto_config
+from common.log_helpers import log_environment, log_event
+
 logger = logging.getLogger( )
 logger.setLevel( logging.INFO )
 
-ses = boto3.client( 'ses', region_name = "eu-west-1" )
-dynamodb = boto3.resource( "dynamodb" )
+log_environment( )
+
+ses = boto3.client( 'ses', region_name = "eu-west-1", config = mail_boto_config )
+dynamodb = boto3.resource( "dynamodb", config = mail_boto_config )
 
 address_table = dynamodb.Table( os.environ[ 'addresses_table_name' ] )
 emails_table = dynamodb.Table( os.environ[ 'emails_table_name' ] )
 
-cors_allowed_origins = os.environ[ 'cors_allowed_origins' ].split( ',' )
-default_allowed_origin = cors_allowed_origins[ 0 ]
+# responses only differ in the allowed origin, everything else is built once per container
+json_headers = { **base_headers, 'Content-Type': 'application/json' }
+bad_request_body = json.dumps( { 'message': 'missing or invalid parameters' } )
+sent_body = json.dumps( { 'message': 'Email sent successfully' } )
+
+# header lines up to this length are written as they are, longer ones are folded
+header_line_length = 78
 
 
 def address_exists_and_user_owned( address, username ):
@@ -37,7 +44,9 @@ def address_exists_and_user_owned( address, username ):
         response = address_table.get_item(
                 Key = {
                     'address': address
-                }
+                },
+                ProjectionExpression = "#t, username",
+                ExpressionAttributeNames = { "#t": "ttl" }
         )
     except ClientError as e:
         logger.info( '## DynamoDB Client Exception' )
@@ -51,60 +60,118 @@ def address_exists_and_user_owned( address, username ):
     return False
 
 
-def user_owns_address( address, username ):
+def check_header_value( value ):
     """
-    check if a given address belongs to a given user
+    Makes sure a value can not end its header line and start a new, injected header
 
-    :param address: the disposable address to check
-    :param username: the username to check against
-    :return: True if the address belongs to the user, False otherwise
-    :raises ClientError: DynamoDB Client Exception
+    :param value: the value that is written into a header
+    :raises ValueError: if the value contains a line break
     """
-    try:
-        response = address_table.get_item(
-                Key = {
-                    'address': address
-                }
-        )
-    except ClientError as e:
-        logger.info( '## DynamoDB Client Exception' )
-        logger.info( e.response[ 'Error' ][ 'Message' ] )
-    else:
-        if 'Item' in response:
-            item = response[ 'Item' ]
-            if item[ 'username' ] == username:
-                return True
-    return False
+    if '\r' in value or '\n' in value:
+        raise ValueError( 'header values may not contain line breaks' )
 
 
-def get_allowed_origins( origin ):
+def encode_header( name, value ):
     """
-    Gets the allowed origins from the environment and checks if a given origin is allowed
-    :param origin: the origin to check
-    :return: origin if allowed, else default origin
+    Writes a header line, it is only folded and RFC 2047 encoded when it is non-ASCII or too long for one line
+
+    :param name: the header name
+    :param value: the header value
+    :return: the header line without line ending, continuation lines are separated by CRLF
+    :raises ValueError: if the value contains a line break
     """
-    if origin in cors_allowed_origins:
-        return origin
-    return default_allowed_origin
+    check_header_value( value )
+    if value.isascii( ) and len( name ) + 2 + len( value ) <= header_line_length:
+        return name + ': ' + value
+    from email import policy
+    return policy.SMTP.fold( *policy.SMTP.header_store_parse( name, value ) ).rstrip( '\r\n' )
+
+
+def encode_content_disposition( filename ):
+    """
+    Writes the Content-Disposition header line of an attachment
+
+    :param filename: the file name of the attachment
+    :return: the header line without line ending
+    :raises ValueError: if the file name contains a line break
+    """
+    # checked before encoding, the RFC 2231 form would hide line breaks until the header is folded
+    check_header_value( filename )
+    if filename.isascii( ) and '"' not in filename and '\\' not in filename:
+        return encode_header( 'Content-Disposition', 'attachment; filename="%s"' % filename )
+    from email.utils import encode_rfc2231
+    return encode_header( 'Content-Disposition', "attachment; filename*=%s" % encode_rfc2231( filename, 'utf-8' ) )
+
+
+def encode_base64_lines( data ):
+    """
+    Encodes data as base64 body with CRLF separated lines
+
+    :param data: the bytes to encode
+    :return: the encoded body as string
+    """
+    # one C level encode of the whole payload, then cut into the 76 character lines MIME allows
+    encoded = base64.b64encode( data ).decode( 'ascii' )
+    return '\r\n'.join( encoded[ i:i + 76 ] for i in range( 0, len( encoded ), 76 ) )
+
+
+def build_raw_email( from_address, to_address, subject, html, attachments ):
+    """
+    Writes a multipart email with a html body and attachments in wire format
+
+    :param from_address: the sender address
+    :param to_address: the recipient address
+    :param subject: the subject of the email
+    :param html: the html body of the email
+    :param attachments: list of dicts with the file name in 'name' and the decoded file content in 'content'
+    :return: the raw email as bytes
+    :raises ValueError: if a header value contains a line break
+    """
+    # only needed once a request passed validation, imported here to keep it out of the cold start
+    import uuid
+
+    boundary = '==' + uuid.uuid4( ).hex
+    lines = [
+        encode_header( 'From', from_address ),
+        encode_header( 'To', to_address ),
+        encode_header( 'Subject', subject ),
+        'MIME-Version: 1.0',
+        'Content-Type: multipart/mixed; boundary="%s"' % boundary,
+        '',
+        'This is a multi-part message in MIME format.',
+        '--' + boundary,
+        'Content-Type: text/html; charset="utf-8"',
+        'Content-Transfer-Encoding: base64',
+        '',
+        encode_base64_lines( html.encode( 'utf-8' ) )
+    ]
+    for attachment in attachments:
+        lines += [
+            '--' + boundary,
+            'Content-Type: application/octet-stream',
+            'Content-Transfer-Encoding: base64',
+            encode_content_disposition( attachment[ 'name' ] ),
+            '',
+            encode_base64_lines( attachment[ 'content' ] )
+        ]
+    lines += [ '--' + boundary + '--', '' ]
+    return '\r\n'.join( lines ).encode( 'ascii' )
 
 
 def lambda_handler( event, context ):
-    logger.info( '## ENVIRONMENT VARIABLES' )
-    logger.info( os.environ )
-    logger.info( '## EVENT' )
-    logger.info( event )
+    log_event( event )
 
     origin = event.get( 'headers', { } ).get( 'origin', default_allowed_origin )
     username = event.get( 'requestContext', { } ).get( 'authorizer', { } ).get( 'claims', { } ).get(
         'cognito:username' )
 
-    body = json.loads( event.get( 'body', { } ) )
+    body = parse_body( event.get( 'body' ) )
 
-    headers = {
-        "access-control-allow-headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-        "access-control-allow-methods": "GET,OPTIONS,POST",
-        "access-control-allow-origin":  get_allowed_origins( origin ),
-        'Content-Type':                 'application/json'
+    headers = { **json_headers, "access-control-allow-origin": get_allowed_origins( origin ) }
+    bad_request = {
+        'statusCode': 400,
+        'body':       bad_request_body,
+        'headers':    headers
     }
 
     to_addresses = body.get( 'toAddress' )
@@ -114,39 +181,35 @@ def lambda_handler( event, context ):
     email_text = body.get( 'emailBodyText' )
     attachments = body.get( 'attachments', [ ] )
 
-    if None not in [ to_addresses, from_address, subject, email_html, email_text, username ]:
-        if address_exists_and_user_owned( from_address, username ):
-            try:
-                msg = MIMEMultipart( 'mixed' )
-                msg[ 'Subject' ] = subject
-                msg[ 'From' ] = from_address
-                msg[ 'To' ] = to_addresses[ 0 ]
-                msg.preamble = 'This is a multi-part message in MIME format.'
-                msg.attach( MIMEText( email_html, 'html' ) )
-                for attachment in attachments:
-                    part = MIMEBase( 'application', "octet-stream" )
-                    part.set_payload( base64.b64decode( attachment[ 'content' ] ) )
-                    encoders.encode_base64( part )
-                    part.add_header( 'Content-Disposition', 'attachment; filename="%s"' % attachment[ 'name' ] )
-                    msg.attach( part )
-
-                ses.send_raw_email(
-                        Source = from_address,
-                        Destinations = to_addresses,
-                        RawMessage = { 'Data': msg.as_string( ) }
-                )
-            except ClientError as e:
-                logger.info( '## SES Client Exception' )
-                logger.info( e.response[ 'Error' ][ 'Message' ] )
-            else:
-                return {
-                    'statusCode': 200,
-                    'body':       json.dumps( { 'message': 'Email sent successfully' } ),
-                    'headers':    headers
-                }
-
-    return {
-        'statusCode': 400,
-        'body':       json.dumps( { 'message': 'missing or invalid parameters' } ),
-        'headers':    headers
-    }
+    # only cheap checks run before the DynamoDB read, the message itself is built once the sender is confirmed
+    if None in [ to_addresses, from_address, subject, email_html, email_text, username ] \
+            or not isinstance( to_addresses, list ) or not to_addresses \
+            or not all( isinstance( value, str ) for value in [ from_address, subject, email_html, *to_addresses ] ):
+        return bad_request
+    try:
+        files = [ { 'name': str( attachment[ 'name' ] ), 'content': base64.b64decode( attachment[ 'content' ] ) }
+                  for attachment in attachments ]
+        for value in [ from_address, to_addresses[ 0 ], subject, *[ file[ 'name' ] for file in files ] ]:
+            check_header_value( value )
+    except ( KeyError, TypeError, ValueError ):
+        return bad_request
+
+    if address_exists_and_user_owned( from_address, username ):
+        try:
+            raw_email = build_raw_email( from_address, to_addresses[ 0 ], subject, email_html, files )
+            ses.send_raw_email(
+                    Source = from_address,
+                    Destinations = to_addresses,
+                    RawMessage = { 'Data': raw_email }
+            )
+        except ClientError as e:
+            logger.info( '## SES Client Exception' )
+            logger.info( e.response[ 'Error' ][ 'Message' ] )
+        else:
+            return {
+                'statusCode': 200,
+                'body':       sent_body,
+                'headers':    headers
+            }
+
+    return bad_request
@@ -1,51 +1,63 @@
-import mimetypes
-import uuid
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-
 import boto3
-from boto3.dynamodb.conditions import Attr
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from boto3.dynamodb.table import BatchWriter
 import json
 import os
 import logging
 import re
-from email import encoders, message_from_string
-from email import policy
+
+from common.boto_helpers import mail_boto_config
+from common.log_helpers import log_environment, log_event
 
 logger = logging.getLogger( )
 logger.setLevel( logging.INFO )
 
-ses = boto3.client( 'ses', region_name = "eu-west-1" )
-s3 = boto3.resource( 's3' )
-dynamodb = boto3.resource( "dynamodb" )
+log_environment( )
+
+ses = boto3.client( 'ses', region_name = "eu-west-1", config = mail_boto_config )
+s3 = boto3.client( 's3', config = mail_boto_config )
+dynamodb = boto3.resource( "dynamodb", config = mail_boto_config )
 
 emails_table = dynamodb.Table( os.environ[ 'emails_table_name' ] )
 addresses_table = dynamodb.Table( os.environ[ 'addresses_table_name' ] )
 reply_addresses_table = dynamodb.Table( os.environ[ 'reply_addresses_table_name' ] )
 
+# reused between invocations to run independent AWS calls side by side.
+# Table resources are not thread safe, calls on the executor use the client of the resource
+executor = ThreadPoolExecutor( max_workers = 4 )
+dynamodb_client = dynamodb.meta.client
+
 valid_domains = os.environ[ 'valid_domains' ].split( ',' )
 bucket_name = os.environ[ 'emails_bucket_name' ]
 
+email_pattern = re.compile( r'[\w.-]+@[\w.-]+' )
+uuid_hex_digits = frozenset( '0123456789abcdef' )
+# original headers that describe the content and the thread, everything else is replaced or dropped on forwarding
+forwarded_headers = frozenset( (
+    b'subject', b'date', b'mime-version', b'content-type', b'content-transfer-encoding', b'in-reply-to', b'references'
+) )
+
 
-def store_email( email ):
+def store_emails( emails ):
     """
-    Stores email information in DynamoDB
-    :param  email: email object
+    Stores email information in DynamoDB, batched into as few requests as possible
+    :param  emails: list of email objects
     :raises ClientError: DynamoDB Client Exception
     """
     try:
-        emails_table.put_item(
-                Item = {
-                    'destination':   email[ 'destination' ][ 0 ],
-                    'messageId':     email[ 'messageId' ],
-                    'timestamp':     email[ 'timestamp' ],
-                    'source':        email[ 'source' ],
-                    'commonHeaders': email[ 'commonHeaders' ],
-                    'isNew':         True
-                }
-        )
+        with BatchWriter( emails_table.name, dynamodb_client, overwrite_by_pkeys = [ 'destination', 'messageId' ] ) as writer:
+            for email in emails:
+                writer.put_item(
+                        Item = {
+                            'destination':   email[ 'destination' ][ 0 ],
+                            'messageId':     email[ 'messageId' ],
+                            'timestamp':     email[ 'timestamp' ],
+                            'source':        email[ 'source' ],
+                            'commonHeaders': email[ 'commonHeaders' ],
+                            'isNew':         True
+                        }
+                )
     except ClientError as e:
         logger.info( '## DynamoDB Client Exception' )
         logger.info( e.response[ 'Error' ][ 'Message' ] )
@@ -61,9 +73,12 @@ def check_redirect_exists( actual_address, disposable_address ):
     :raises ClientError: DynamoDB Client Exception
     """
     try:
-        response = reply_addresses_table.scan(
-                FilterExpression = Attr( 'actualAddress' ).eq( actual_address )
-                                   & Attr( 'disposableAddress' ).eq( disposable_address )
+        response = dynamodb_client.query(
+                TableName = reply_addresses_table.name,
+                IndexName = 'disposable-index',
+                KeyConditionExpression = "disposableAddress = :d AND actualAddress = :a",
+                ExpressionAttributeValues = { ":d": disposable_address, ":a": actual_address },
+                Limit = 1
         )
     except ClientError as e:
         logger.info( '## DynamoDB Client Exception' )
@@ -82,6 +97,8 @@ def generate_email( original_address ):
     :param original_address: the original email address (the part before the @)
     :return: the generated email address
     """
+    # only needed when a new redirect is created, imported here to keep it out of the cold start
+    import uuid
     return str( uuid.uuid4( ) ) + "+" + original_address + "@" + valid_domains[ 0 ]
 
 
@@ -132,31 +149,76 @@ def load_email_from_s3( message_id ):
     """
     Loads the raw email file from S3
     :param message_id: the message id of the email ( message id is the same as the object key in S3 )
-    :return: Array with the html and text parts of the email
+    :return: the raw bytes of the email
     """
-    obj = s3.Object( bucket_name, message_id )
-    body = obj.get( )[ 'Body' ].read( )
-    msg = message_from_string( body.decode( 'utf-8' ), policy = policy.default )
-    html_body = msg.get_body( 'html' ).get_content( )
-    plain_body = msg.get_body( 'plain' ).get_content( )
-    attachments = [ ]
-    for part in msg.walk( ):
-        if part.get_content_maintype( ) == 'multipart':
-            continue
-        if part.get( 'Content-Disposition' ) is None:
-            continue
-        filename = part.get_filename( )
-        if not filename:
-            ext = mimetypes.guess_extension( part.get_content_type( ) )
-            if not ext:
-                ext = '.bin'
-            filename = 'part-%03d%s' % (len( attachments ), ext)
-        attachments.append(
-                {
-                    'filename': filename,
-                    'content':  part.get_payload( decode = True )
-                } )
-    return html_body, plain_body, attachments
+    return s3.get_object( Bucket = bucket_name, Key = message_id )[ 'Body' ].read( )
+
+
+def delete_email_object( message_id ):
+    """
+    Deletes the raw email file from S3
+    :param message_id: the message id of the email ( message id is the same as the object key in S3 )
+    """
+    logger.info( "## delete Message from S3 with ID:" )
+    logger.info( message_id )
+    s3.delete_object( Bucket = bucket_name, Key = message_id )
+
+
+def build_forward_email( raw_email, from_address, to_address ):
+    """
+    Rewrites the headers of a raw email for forwarding, the body is passed through untouched
+
+    :param raw_email: the raw bytes of the original email
+    :param from_address: the address the email is forwarded from
+    :param to_address: the address the email is forwarded to
+    :return: the raw bytes of the email to forward
+    """
+    header_end = raw_email.find( b'\r\n\r\n' )
+    separator_length = 4
+    if header_end == -1:
+        header_end = raw_email.find( b'\n\n' )
+        separator_length = 2
+    if header_end == -1:
+        header_block, body = raw_email, b''
+    else:
+        header_block, body = raw_email[ :header_end ], raw_email[ header_end + separator_length: ]
+
+    # group folded continuation lines with the header they belong to
+    headers = [ ]
+    for line in header_block.splitlines( ):
+        if line[ :1 ] in ( b' ', b'\t' ) and headers:
+            headers[ -1 ].append( line )
+        else:
+            headers.append( [ line ] )
+
+    new_headers = [ b'From: ' + from_address.encode( ), b'To: ' + to_address.encode( ) ]
+    for header in headers:
+        name = header[ 0 ].split( b':', 1 )[ 0 ].strip( ).lower( )
+        if name in forwarded_headers:
+            new_headers.extend( header )
+
+    return b'\r\n'.join( new_headers ) + b'\r\n\r\n' + body
+
+
+def forward_email( message_id, from_address, to_address, delete_after_sending ):
+    """
+    Forwards a stored email with rewritten From and To headers
+    :param message_id: the message id of the email ( message id is the same as the object key in S3 )
+    :param from_address: the address the email is forwarded from
+    :param to_address: the address the email is forwarded to
+    :param delete_after_sending: True if the stored email is deleted once it was sent
+    :raises ClientError: SES or S3 Client Exception
+    """
+    # forward the original body as is, only the headers are rewritten
+    raw_email = build_forward_email( load_email_from_s3( message_id ), from_address, to_address )
+    ses.send_raw_email(
+            Source = from_address,
+            Destinations = [ to_address ],
+            RawMessage = { 'Data': raw_email }
+    )
+    # only deleted after a successful send, a failed send is retried with the stored email still in place
+    if delete_after_sending:
+        delete_email_object( message_id )
 
 
 def extract_email( email ):
@@ -166,7 +228,7 @@ def extract_email( email ):
     :param email: the string to extract the email address from
     :return: the extracted email address
     """
-    return re.search( r'[\w.-]+@[\w.-]+', email ).group( 0 )
+    return email_pattern.search( email ).group( 0 )
 
 
 def proxy_address_exists( proxy_address ):
@@ -193,35 +255,41 @@ def proxy_address_exists( proxy_address ):
 
 def contains_uuid( string ):
     """
-    Checks if a string contains an uuid
+    Checks if a string starts with an uuid
 
     :param string: the string to check
     :return: True if the string contains an uuid, False otherwise
     """
-    return re.match( r'[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}', string )
+    # proxy addresses start with a lowercase uuid4, checked by position instead of running a regex
+    return len( string ) >= 36 \
+        and string[ 8 ] == string[ 13 ] == string[ 18 ] == string[ 23 ] == '-' \
+        and all( c in uuid_hex_digits
+                 for c in string[ 0:8 ] + string[ 9:13 ] + string[ 14:18 ] + string[ 19:23 ] + string[ 24:36 ] )
 
 
-def lambda_handler( event, context ):
-    logger.info( '## ENVIRONMENT VARIABLES' )
-    logger.info( os.environ )
-    logger.info( '## EVENT' )
-    logger.info( event )
+def resolve_forwarding( mail ):
+    """
+    Works out where an incoming email has to be forwarded to, creating a redirect if needed
 
-    mail = json.loads( event[ 'Records' ][ 0 ][ 'Sns' ][ 'Message' ] )[ 'mail' ]
+    :param mail: the mail object of the SES notification
+    :return: tuple of from address and to address ( both None if the email is not forwarded )
+             and True if the email was send to a proxy address, False if it was send to a disposable address
+    """
     source = extract_email( mail[ 'commonHeaders' ][ 'from' ][ 0 ] )
     destination = mail[ 'destination' ][ 0 ]
 
     to_address = None
     from_address = None
 
-    is_redirected_email = False
     disposable_email_item = None
     # non-expensive check if email was send to proxy- or disposable address, possibly saving 1 DynamoDB call
     if not contains_uuid( destination ):
+        # the redirect lookup is usually needed, run it alongside the address lookup instead of after it
+        redirect_future = executor.submit( check_redirect_exists, source, destination )
         disposable_email_item = redirect_enabled( destination )
     if disposable_email_item is not None:  # email send to disposable address
         if disposable_email_item[ 'enabled' ]:
-            redirect = check_redirect_exists( source, destination )
+            redirect = redirect_future.result( )
             to_address = disposable_email_item[ 'actualAddress' ]
             if redirect is not None:
                 from_address = redirect[ 'proxyAddress' ]
@@ -229,37 +297,35 @@ def lambda_handler( event, context ):
                 proxy_address = generate_email( source.split( '@' )[ 0 ] )
                 create_redirect( proxy_address, source, destination )
                 from_address = proxy_address
-        store_email( mail )
-    else:  # proxy address
-        redirect = proxy_address_exists( destination )
-        if redirect is not None:  # if None, email was send to a non-existing proxy address
-            to_address = redirect[ 'actualAddress' ]
-            from_address = redirect[ 'disposableAddress' ]
-        # delete redirected messages from S3
-        is_redirected_email = True
-
-    if to_address is not None and from_address is not None:
-        [ html_body, plain_body, attachments ] = load_email_from_s3( mail[ 'messageId' ] )
-        msg = MIMEMultipart( 'mixed' )
-        msg[ 'Subject' ] = mail[ 'commonHeaders' ][ 'subject' ]
-        msg[ 'From' ] = from_address
-        msg[ 'To' ] = to_address
-        msg.preamble = 'This is a multi-part message in MIME format.'
-        msg.attach( MIMEText( html_body, 'html' ) )
-        for attachment in attachments:
-            part = MIMEBase( 'application', "octet-stream" )
-            part.set_payload( attachment[ 'content' ] )
-            encoders.encode_base64( part )
-            part.add_header( 'Content-Disposition', 'attachment; filename="%s"' % attachment[ 'filename' ] )
-            msg.attach( part )
-
-        ses.send_raw_email(
-                Source = from_address,
-                Destinations = [ to_address ],
-                RawMessage = { 'Data': msg.as_string( ) }
-        )
+        return from_address, to_address, False
+    # proxy address
+    redirect = proxy_address_exists( destination )
+    if redirect is not None:  # if None, email was send to a non-existing proxy address
+        to_address = redirect[ 'actualAddress' ]
+        from_address = redirect[ 'disposableAddress' ]
+    return from_address, to_address, True
 
-    if is_redirected_email:
-        logger.info( "## delete Message from S3 with ID:" )
-        logger.info( mail[ 'messageId' ] )
-        s3.Object( bucket_name, mail[ 'messageId' ] ).delete( )
+
+def lambda_handler( event, context ):
+    log_event( event )
+
+    # SNS may deliver more than one notification per invocation
+    mails = [ json.loads( record[ 'Sns' ][ 'Message' ] )[ 'mail' ] for record in event[ 'Records' ] ]
+    routes = [ resolve_forwarding( mail ) for mail in mails ]
+
+    # emails send to disposable addresses are stored in one batch while the forwarding runs
+    futures = [ ]
+    stored_mails = [ mail for mail, ( _, _, is_redirected_email ) in zip( mails, routes ) if not is_redirected_email ]
+    if stored_mails:
+        futures.append( executor.submit( store_emails, stored_mails ) )
+
+    for mail, ( from_address, to_address, is_redirected_email ) in zip( mails, routes ):
+        if to_address is not None and from_address is not None:
+            futures.append(
+                    executor.submit( forward_email, mail[ 'messageId' ], from_address, to_address, is_redirected_email )
+            )
+        elif is_redirected_email:  # send to a non-existing proxy address, nothing to forward
+            futures.append( executor.submit( delete_email_object, mail[ 'messageId' ] ) )
+
+    for future in futures:
+        future.result( )